@@ -20,6 +20,7 @@
 Parsers for basis set in the NWChem format
 '''
 
+import os
 import re
 import numpy
 import scipy.linalg
@@ -38,8 +39,9 @@ MAPSPDF = {'S': 0,
            'L': 8,
            'M': 9,
           }
+# Angular momentum of the ECP block headers. "UL" is the local part.
+ECP_MAPSPDF = dict(MAPSPDF, UL=-1)
 
-BASIS_SET_DELIMITER = re.compile('# *BASIS SET.*\n|END\n')
 ECP_DELIMITER = re.compile('\n *ECP *\n')
 
 def parse(string, symb=None, optimize=True):
@@ -85,7 +87,7 @@ def parse(string, symb=None, optimize=True):
     '''
     if symb is not None:
         symb = _std_symbol(symb)
-        string = _search_seg(re.split(BASIS_SET_DELIMITER, string), symb)
+        string = _split_seg(string).get(symb)
         if string is None:
             raise KeyError('Basis not found for %s' % symb)
 
@@ -132,32 +134,81 @@ def load_ecp(basisfile, symb):
 
 def search_seg(basisfile, symb):
     symb = _std_symbol(symb)
-    with open(basisfile, 'r') as fin:
-        fdata = re.split(BASIS_SET_DELIMITER, fin.read())
-    dat = _search_seg(fdata, symb)
+    dat = _read_file(basisfile, _split_seg).get(symb)
     if dat is None:
         return []
     else:
         return [x.upper() for x in dat.splitlines() if x and 'END' not in x]
 
-def _search_seg(raw_data, symb):
-    for dat in raw_data:
+def _split_seg(string):
+    '''Split the basis text at the lines "#BASIS SET ..." and "END". Return a
+    dict which maps the first word of each segment (the element symbol) to the
+    text of the segment. Only the first segment of each symbol is kept.
+    '''
+    segs = {}
+    symb = None
+    seg = []
+    for line in string.splitlines():
+        x = line.lstrip()
+        if (line.endswith('END') or
+            (x.startswith('#') and x[1:].lstrip(' ').startswith('BASIS SET'))):
+            if symb is not None and symb not in segs:
+                segs[symb] = '\n'.join(seg)
+            symb = None
+            seg = []
+        else:
+            if symb is None and x:
+                symb = x.split(None, 1)[0]
+            seg.append(line)
+    if symb is not None and symb not in segs:
+        segs[symb] = '\n'.join(seg)
+    return segs
+
+def _split_ecp(string):
+    '''The lines of the ECP section of the basis text, and a dict which maps
+    the first word of the lines (the element symbol) to the index of the line
+    where it first appears.
+    '''
+    fdata = re.split(ECP_DELIMITER, string)
+    if len(fdata) <= 1:
+        return None
+
+    fdata = fdata[1].splitlines()
+    index = {}
+    for i, dat in enumerate(fdata):
         dat0 = dat.split(None, 1)
-        if dat0 and dat0[0] == symb:
-            return dat
+        if dat0 and dat0[0] not in index:
+            index[dat0[0]] = i
+    return fdata, index
+
+# Contents of the basis files which have been read, keyed by the file path
+# and the function which processed the text. The modification time and the
+# size of the file are stored to detect the changes of the file.
+_FILE_CACHE = {}
+
+def _read_file(basisfile, convert):
+    '''Read the basis file and return convert(text). The result is cached and
+    reused until the file is modified.
+    '''
+    path = os.path.abspath(basisfile)
+    stat = os.stat(path)
+    file_id = (stat.st_mtime, stat.st_size)
+    key = (path, convert)
+    if key not in _FILE_CACHE or _FILE_CACHE[key][0] != file_id:
+        with open(path, 'r') as fin:
+            _FILE_CACHE[key] = (file_id, convert(fin.read()))
+    return _FILE_CACHE[key][1]
 
 def search_ecp(basisfile, symb):
     symb = _std_symbol(symb)
-    with open(basisfile, 'r') as fin:
-        fdata = re.split(ECP_DELIMITER, fin.read())
-    if len(fdata) <= 1:
+    ecp_data = _read_file(basisfile, _split_ecp)
+    if ecp_data is None:
         return []
 
-    fdata = fdata[1].splitlines()
-    for i, dat in enumerate(fdata):
-        dat0 = dat.split(None, 1)
-        if dat0 and dat0[0] == symb:
-            break
+    fdata, index = ecp_data
+    if symb not in index:
+        return []
+    i = index[symb]
     seg = []
     for dat in fdata[i:]:
         dat = dat.strip().upper()
@@ -216,32 +267,25 @@ def convert_ecp_to_nwchem(symb, ecp):
     return '\n'.join(res)
 
 def _parse(raw_basis, optimize=True):
-    basis_add = []
+    # Shells are collected in buckets of angular momentum
+    basis_add = [[] for l in range(MAXL)]
+    key = None
+    shell_data = []
     for line in raw_basis:
         dat = line.strip()
         if not dat or dat.startswith('#'):
             continue
         elif dat[0].isalpha():
+            _add_shell(basis_add, key, shell_data)
             key = dat.split()[1]
-            if key == 'SP':
-                basis_add.append([0])
-                basis_add.append([1])
-            else:
-                basis_add.append([MAPSPDF[key]])
+            shell_data = []
+        elif key is None:
+            raise RuntimeError('\nData found before the shell header\n'
+                               'or the required basis file not existed.')
         else:
-            try:
-                line = [float(x) for x in dat.replace('D','e').split()]
-            except BaseException as e:
-                raise RuntimeError('\n' + str(e) +
-                                   '\nor the required basis file not existed.')
-            if key == 'SP':
-                basis_add[-2].append([line[0], line[1]])
-                basis_add[-1].append([line[0], line[2]])
-            else:
-                basis_add[-1].append(line)
-    basis_sorted = []
-    for l in range(MAXL):
-        basis_sorted.extend([b for b in basis_add if b[0] == l])
+            shell_data.append(dat)
+    _add_shell(basis_add, key, shell_data)
+    basis_sorted = [b for bas_l in basis_add for b in bas_l]
 
     if optimize:
         basis_sorted = optimize_contraction(basis_sorted)
@@ -249,6 +293,34 @@ def _parse(raw_basis, optimize=True):
     basis_sorted = remove_zero(basis_sorted)
     return basis_sorted
 
+def _add_shell(basis_add, key, shell_data):
+    if key is None:
+        return
+    dat = _parse_block(shell_data)
+    if key == 'SP':
+        basis_add[0].append([0] + dat[:,[0,1]].tolist())
+        basis_add[1].append([1] + dat[:,[0,2]].tolist())
+    else:
+        l = MAPSPDF[key]
+        basis_add[l].append([l] + dat.tolist())
+
+def _parse_block(lines):
+    '''Convert the lines of numbers of a shell to a 2D array in one pass'''
+    if not lines:
+        return numpy.empty((0,3))
+    rows = [line.replace('D','e').split() for line in lines]
+    ncol = len(rows[0])
+    for row in rows:
+        if len(row) != ncol:
+            raise RuntimeError('\nInconsistent number of columns in line\n'
+                               '%s\nor the required basis file not existed.'
+                               % ' '.join(row))
+    try:
+        return numpy.array(rows, dtype=float)
+    except ValueError as e:
+        raise RuntimeError('\n' + str(e) +
+                           '\nor the required basis file not existed.')
+
 def optimize_contraction(basis):
     '''Search the basis segments which have the same exponents then merge them
     to the general contracted sets.
@@ -348,35 +420,48 @@ def remove_zero(basis):
     return new_basis
 
 def _parse_ecp(raw_ecp):
-    ecp_add = []
+    # ECP blocks are collected in buckets of angular momentum, starting from
+    # the "ul" block (l = -1)
+    ecp_add = [[] for l in range(-1, MAXL)]
     nelec = None
+    by_ang = None
+    ecp_data = []
     for line in raw_ecp:
         dat = line.strip()
         if not dat or dat.startswith('#'): # comment line
             continue
         elif dat[0].isalpha():
+            _add_ecp_data(by_ang, ecp_data)
+            ecp_data = []
             key = dat.split()[1]
             if key == 'NELEC':
                 nelec = int(dat.split()[2])
                 continue
-            elif key == 'UL':
-                ecp_add.append([-1])
-            else:
-                ecp_add.append([MAPSPDF[key]])
+            l = ECP_MAPSPDF[key]
             by_ang = [[], [], [], []]
-            ecp_add[-1].append(by_ang)
+            ecp_add[l+1].append([l, by_ang])
         else:
-            line = dat.replace('D','e').split()
-            l = int(line[0])
-            by_ang[l].append([float(x) for x in line[1:]])
+            ecp_data.append(dat)
+    _add_ecp_data(by_ang, ecp_data)
 
     if nelec is None:
         return []
     else:
-        bsort = []
-        for l in range(-1, MAXL):
-            bsort.extend([b for b in ecp_add if b[0] == l])
-        return [nelec, bsort]
+        return [nelec, [b for ecp_l in ecp_add for b in ecp_l]]
+
+def _add_ecp_data(by_ang, ecp_data):
+    '''Distribute the lines "r_order exponent coefficient" of an ECP block to
+    the lists of radial orders'''
+    if not ecp_data:
+        return
+    if by_ang is None:
+        raise RuntimeError('\nData found before the ECP block header')
+    dat = _parse_block(ecp_data)
+    r_orders = dat[:,0].astype(int)
+    if not numpy.array_equal(r_orders, dat[:,0]):
+        raise RuntimeError('\nNon-integer radial order found in ECP data')
+    for r_order, e_c in zip(r_orders.tolist(), dat[:,1:].tolist()):
+        by_ang[r_order].append(e_c)
 
 if __name__ == '__main__':
     from pyscf import gto
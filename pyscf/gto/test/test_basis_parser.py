@@ -74,6 +74,28 @@ Li    S
         self.assertEqual(len(b[0][1:]), 3)
         self.assertEqual(len(b[1][1:]), 3)
 
+    def test_basis_load_modified_file(self):
+        ftmp = tempfile.NamedTemporaryFile()
+        ftmp.write('''
+Li    S
+     16.1195750              0.15432897
+      2.9362007              0.53532814
+                   '''.encode())
+        ftmp.flush()
+        b = gto.basis.load(ftmp.name, 'Li')
+        self.assertEqual(len(b), 1)
+        b[0].append([1., 1.])
+        self.assertEqual(len(gto.basis.load(ftmp.name, 'Li')[0][1:]), 2)
+
+        ftmp.write('''
+Li    P
+      0.6362897              1.0
+                   '''.encode())
+        ftmp.flush()
+        b = gto.basis.load(ftmp.name, 'Li')
+        self.assertEqual(len(b), 2)
+        self.assertEqual(b[1][0], 1)
+
     def test_basis_load_ecp(self):
         self.assertEqual(gto.basis.load_ecp(__file__, 'H'), [])
 
@@ -93,6 +115,14 @@ C    SP
         basis_dat = gto.basis.parse_nwchem.parse(basis_str)
         self.assertEqual(len(basis_dat), 3)
 
+    def test_parse_basis_ragged_lines(self):
+        basis_str = '''
+H    S
+      1.0                    0.5
+      2.0                    0.3            0.2            0.1'''
+        self.assertRaises(RuntimeError, gto.basis.parse_nwchem.parse,
+                          basis_str, optimize=False)
+
     def test_parse_ecp(self):
         ecp_str = '''
 #
@@ -122,6 +152,19 @@ Na P
             gto.basis.parse_nwchem.convert_ecp_to_nwchem('Na', ecpdat), 'Na')
         self.assertEqual(ecpdat, ecpdat1)
 
+    def test_parse_ecp_malformed_data(self):
+        ecp_str = '''
+H nelec 2
+H ul
+2      1.0      2.0      3.0
+1      4.0'''
+        self.assertRaises(RuntimeError, gto.basis.parse_nwchem.parse_ecp, ecp_str)
+        ecp_str = '''
+H nelec 2
+H ul
+2.5    1.0      2.0'''
+        self.assertRaises(RuntimeError, gto.basis.parse_nwchem.parse_ecp, ecp_str)
+
     def test_optimize_contraction(self):
         bas = gto.parse(r'''
 #BASIS SET: (6s,3p) -> [2s,1p]
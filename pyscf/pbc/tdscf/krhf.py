@@ -20,7 +20,6 @@
 # J. Mol. Struct. THEOCHEM, 914, 3
 #
 
-from functools import reduce
 import numpy
 from pyscf import lib
 from pyscf.lib import logger
@@ -39,15 +38,24 @@ class TDA(rhf.TDA):
 #TODO: Add a warning message for small mesh.
 
     conv_tol = getattr(__config__, 'pbc_tdscf_rhf_TDA_conv_tol', 1e-6)
+    # Transform the trial vectors and the response between MO and AO basis in
+    # single precision. The J/K build and the orbital energy terms are
+    # computed in double precision.
+    mixed_precision = getattr(__config__, 'pbc_tdscf_rhf_TDA_mixed_precision', False)
 
     def __init__(self, mf):
         from pyscf.pbc import scf
         assert(isinstance(mf, scf.khf.KSCF))
         self.cell = mf.cell
         rhf.TDA.__init__(self, mf)
+        self._keys = self._keys.union(['mixed_precision'])
         from pyscf.pbc.df.df_ao2mo import warn_pbc2d_eri
         warn_pbc2d_eri(mf)
 
+    def dump_flags(self, verbose=None):
+        rhf.TDA.dump_flags(self, verbose)
+        logger.info(self, 'mixed_precision = %s', self.mixed_precision)
+
     def gen_vind(self, mf):
         singlet = self.singlet
         cell = mf.cell
@@ -63,37 +71,64 @@ class TDA(rhf.TDA):
         orbo = [mo_coeff[k][:,occidx[k]] for k in range(nkpts)]
         orbv = [mo_coeff[k][:,viridx[k]] for k in range(nkpts)]
         e_ia = _get_e_ia(mo_energy, mo_occ)
+        nocc = numpy.count_nonzero(numpy.asarray(mo_occ) > 0, axis=1)
+        nvir = nmo - nocc
         # FIXME: hdiag corresponds to the orbital energy with the exxdiv
         # correction. The integrals in A, B matrices do not have the
         # contribution from the exxdiv. Should the exchange correction be
         # removed from hdiag?
         hdiag = numpy.hstack([x.ravel() for x in e_ia])
 
+        # Real orbitals (at the gamma point) are kept real, so that the density
+        # matrices of real trial vectors are real for the J/K build
+        real_orbitals = all(c.dtype == numpy.double for c in mo_coeff)
+        if self.mixed_precision:
+            dtype = numpy.float32 if real_orbitals else numpy.complex64
+        else:
+            dtype = numpy.double if real_orbitals else numpy.complex128
+        orbo, orbv = _stack_ov(orbo, orbv, dtype)
+        orbo_h = numpy.asarray(orbo.conj().transpose(0,2,1), order='C')
+        orbv_h = numpy.asarray(orbv.conj().transpose(0,2,1), order='C')
+        nocc_max = orbo.shape[2]
+        nvir_max = orbv.shape[2]
+
         mem_now = lib.current_memory()[0]
         max_memory = max(2000, self.max_memory*.8-mem_now)
         vresp = _gen_rhf_response(mf, singlet=singlet, hermi=0,
                                   max_memory=max_memory)
+        # Work space of vind, reused in every Davidson iteration
+        bufs = {}
 
         def vind(zs):
+            zs = numpy.asarray(zs)
             nz = len(zs)
-            z1s = [_unpack(z, mo_occ) for z in zs]
-            dmov = numpy.empty((nz,nkpts,nao,nao), dtype=numpy.complex128)
-            for i in range(nz):
-                for k in range(nkpts):
-                    # *2 for double occupancy
-                    dm1 = z1s[i][k] * 2
-                    dmov[i,k] = reduce(numpy.dot, (orbo[k], dm1, orbv[k].conj().T))
+            z1 = _pad_ov(zs, nocc, nvir, nocc_max, nvir_max)
+            wtype = _promote(dtype, zs)
+            dmtype = numpy.result_type(wtype, numpy.double)
+            dmov = numpy.ndarray((nz,nkpts,nao,nao), dtype=dmtype,
+                                 buffer=_get_buffer(bufs, 'dmov', nz*nkpts*nao**2,
+                                                    dmtype))
+            size = nz*nkpts*nao*max(nocc_max,nvir_max)
+            # All states and k-points are transformed in one batched matmul
+            tmp = numpy.ndarray((nz,nkpts,nocc_max,nao), dtype=wtype,
+                                buffer=_get_buffer(bufs, 'tmp', size, wtype))
+            numpy.matmul(z1.astype(wtype, copy=False), orbv_h, out=tmp)
+            tmp *= 2  # *2 for double occupancy
+            numpy.matmul(orbo, tmp, out=dmov)
 
             with lib.temporary_env(mf, exxdiv=None):
                 v1ao = vresp(dmov)
-            v1s = []
-            for i in range(nz):
-                dm1 = z1s[i]
-                for k in range(nkpts):
-                    v1vo = reduce(numpy.dot, (orbo[k].conj().T, v1ao[i,k], orbv[k]))
-                    v1vo += e_ia[k] * dm1[k]
-                    v1s.append(v1vo.ravel())
-            return lib.asarray(v1s).reshape(nz,-1)
+            wtype = _promote(wtype, v1ao)
+            tmp = numpy.ndarray((nz,nkpts,nao,nvir_max), dtype=wtype,
+                                buffer=_get_buffer(bufs, 'tmp', size, wtype))
+            numpy.matmul(v1ao.astype(wtype, copy=False), orbv, out=tmp)
+            v1vo = numpy.matmul(orbo_h, tmp)
+            v1 = numpy.empty((nz,hdiag.size),
+                             dtype=numpy.result_type(wtype, numpy.double))
+            _unpad_ov(v1vo, nocc, nvir, out=v1)
+            # The orbital energy differences are applied on the packed vectors
+            v1 += hdiag * zs
+            return v1
         return vind, hdiag
 
     def init_guess(self, mf, nstates=None):
@@ -156,45 +191,79 @@ class TDHF(TDA):
         orbo = [mo_coeff[k][:,occidx[k]] for k in range(nkpts)]
         orbv = [mo_coeff[k][:,viridx[k]] for k in range(nkpts)]
         e_ia = _get_e_ia(mo_energy, mo_occ)
+        nocc = numpy.count_nonzero(numpy.asarray(mo_occ) > 0, axis=1)
+        nvir = nmo - nocc
         hdiag = numpy.hstack([x.ravel() for x in e_ia])
         tot_x = hdiag.size
+        # The diagonal of [A, B; -B*, -A*] without the J/K contribution
+        e_ia_xy = numpy.hstack((hdiag, -hdiag))
         hdiag = numpy.hstack((hdiag, hdiag))
 
+        # Real orbitals (at the gamma point) are kept real, so that the density
+        # matrices of real trial vectors are real for the J/K build
+        real_orbitals = all(c.dtype == numpy.double for c in mo_coeff)
+        if self.mixed_precision:
+            dtype = numpy.float32 if real_orbitals else numpy.complex64
+        else:
+            dtype = numpy.double if real_orbitals else numpy.complex128
+        orbo, orbv = _stack_ov(orbo, orbv, dtype)
+        orbo_h = numpy.asarray(orbo.conj().transpose(0,2,1), order='C')
+        orbv_h = numpy.asarray(orbv.conj().transpose(0,2,1), order='C')
+        nocc_max = orbo.shape[2]
+        nvir_max = orbv.shape[2]
+        # [C_occ C_vir] and [C_vir C_occ] to transform the X and Y parts in the
+        # same matrix multiplication
+        orbov = numpy.concatenate((orbo, orbv), axis=2)
+        orbvo = numpy.concatenate((orbv, orbo), axis=2)
+
         mem_now = lib.current_memory()[0]
         max_memory = max(2000, self.max_memory*.8-mem_now)
         vresp = _gen_rhf_response(mf, singlet=singlet, hermi=0,
                                   max_memory=max_memory)
+        # Work space of vind, reused in every Davidson iteration
+        bufs = {}
 
         def vind(xys):
+            xys = numpy.asarray(xys)
             nz = len(xys)
-            z1xs = [_unpack(xy[:tot_x], mo_occ) for xy in xys]
-            z1ys = [_unpack(xy[tot_x:], mo_occ) for xy in xys]
-            dmov = numpy.empty((nz,nkpts,nao,nao), dtype=numpy.complex128)
-            for i in range(nz):
-                for k in range(nkpts):
-                    # *2 for double occupancy
-                    dmx = z1xs[i][k] * 2
-                    dmy = z1ys[i][k] * 2
-                    dmov[i,k] = reduce(numpy.dot, (orbo[k], dmx, orbv[k].T.conj()))
-                    dmov[i,k]+= reduce(numpy.dot, (orbv[k], dmy.T, orbo[k].T.conj()))
+            x1 = _pad_ov(xys[:,:tot_x], nocc, nvir, nocc_max, nvir_max)
+            y1 = _pad_ov(xys[:,tot_x:], nocc, nvir, nocc_max, nvir_max)
+            wtype = _promote(dtype, xys)
+            dmtype = numpy.result_type(wtype, numpy.double)
+            dmov = numpy.ndarray((nz,nkpts,nao,nao), dtype=dmtype,
+                                 buffer=_get_buffer(bufs, 'dmov', nz*nkpts*nao**2,
+                                                    dmtype))
+            nmo_max = nocc_max + nvir_max
+            size = nz*nkpts*nao*nmo_max
+            # dmov = C_occ X C_vir^H + C_vir Y^T C_occ^H. X C_vir^H and
+            # Y^T C_occ^H are stacked to do the second product in one call.
+            # All states and k-points are transformed in one batched matmul.
+            tmp = numpy.ndarray((nz,nkpts,nmo_max,nao), dtype=wtype,
+                                buffer=_get_buffer(bufs, 'tmp', size, wtype))
+            numpy.matmul(x1.astype(wtype, copy=False), orbv_h,
+                         out=tmp[:,:,:nocc_max])
+            numpy.matmul(y1.astype(wtype, copy=False).transpose(0,1,3,2), orbo_h,
+                         out=tmp[:,:,nocc_max:])
+            tmp *= 2  # *2 for double occupancy
+            numpy.matmul(orbov, tmp, out=dmov)
 
             with lib.temporary_env(mf, exxdiv=None):
                 v1ao = vresp(dmov)
-            v1s = []
-            for i in range(nz):
-                dmx = z1xs[i]
-                dmy = z1ys[i]
-                v1xs = []
-                v1ys = []
-                for k in range(nkpts):
-                    v1x = reduce(numpy.dot, (orbo[k].T.conj(), v1ao[i,k], orbv[k]))
-                    v1y = reduce(numpy.dot, (orbv[k].T.conj(), v1ao[i,k], orbo[k])).T
-                    v1x+= e_ia[k] * dmx[k]
-                    v1y+= e_ia[k] * dmy[k]
-                    v1xs.append(v1x.ravel())
-                    v1ys.append(-v1y.ravel())
-                v1s += v1xs + v1ys
-            return lib.asarray(v1s).reshape(nz,-1)
+            # v1ao C_vir and v1ao C_occ in one batched matmul
+            wtype = _promote(wtype, v1ao)
+            tmp = numpy.ndarray((nz,nkpts,nao,nmo_max), dtype=wtype,
+                                buffer=_get_buffer(bufs, 'tmp', size, wtype))
+            numpy.matmul(v1ao.astype(wtype, copy=False), orbvo, out=tmp)
+            v1x = numpy.matmul(orbo_h, tmp[:,:,:,:nvir_max])
+            v1y = numpy.matmul(orbv_h, tmp[:,:,:,nvir_max:]).transpose(0,1,3,2)
+            v1xy = numpy.empty((nz,tot_x*2),
+                               dtype=numpy.result_type(wtype, numpy.double))
+            _unpad_ov(v1x, nocc, nvir, out=v1xy[:,:tot_x])
+            _unpad_ov(v1y, nocc, nvir, out=v1xy[:,tot_x:])
+            v1xy[:,tot_x:] *= -1
+            # The orbital energy differences are applied on the packed vectors
+            v1xy += e_ia_xy * xys
+            return v1xy
         return vind, hdiag
 
     def init_guess(self, mf, nstates=None):
@@ -255,12 +324,81 @@ def _get_e_ia(mo_energy, mo_occ):
         e_ia.append(mo_energy[k][viridx] - mo_energy[k][occidx,None])
     return e_ia
 
+def _stack_ov(orbo, orbv, dtype=numpy.complex128):
+    '''Stack the occupied and virtual orbitals of all k-points in arrays of
+    shape (nkpts,nao,nocc_max) and (nkpts,nao,nvir_max) of the given dtype.
+    The k-points which have fewer occupied or virtual orbitals are padded with
+    zeros.
+    '''
+    nkpts = len(orbo)
+    nao = orbo[0].shape[0]
+    nocc_max = max(x.shape[1] for x in orbo)
+    nvir_max = max(x.shape[1] for x in orbv)
+    orbo_pad = numpy.zeros((nkpts,nao,nocc_max), dtype=dtype)
+    orbv_pad = numpy.zeros((nkpts,nao,nvir_max), dtype=dtype)
+    for k in range(nkpts):
+        orbo_pad[k,:,:orbo[k].shape[1]] = orbo[k]
+        orbv_pad[k,:,:orbv[k].shape[1]] = orbv[k]
+    return orbo_pad, orbv_pad
+
+def _pad_ov(zs, nocc, nvir, nocc_max, nvir_max):
+    '''Unpack the packed ov vectors zs to a zero-padded array of shape
+    (nz,nkpts,nocc_max,nvir_max)'''
+    nz = len(zs)
+    nkpts = len(nocc)
+    if all(x == nocc_max for x in nocc) and all(x == nvir_max for x in nvir):
+        # No padding is needed if all k-points have the same number of
+        # occupied and virtual orbitals
+        return zs.reshape(nz,nkpts,nocc_max,nvir_max)
+
+    z1 = numpy.zeros((nz,nkpts,nocc_max,nvir_max), dtype=zs.dtype)
+    p1 = 0
+    for k in range(nkpts):
+        p0, p1 = p1, p1 + nocc[k] * nvir[k]
+        z1[:,k,:nocc[k],:nvir[k]] = zs[:,p0:p1].reshape(nz,nocc[k],nvir[k])
+    return z1
+
+def _unpad_ov(z1, nocc, nvir, out=None):
+    '''Inverse of _pad_ov. The packed vectors are written to out if it is
+    given.'''
+    nz, nkpts, nocc_max, nvir_max = z1.shape
+    if all(x == nocc_max for x in nocc) and all(x == nvir_max for x in nvir):
+        if out is None:
+            return z1.reshape(nz,-1)
+        out.reshape(z1.shape)[:] = z1
+        return out
+
+    if out is None:
+        out = numpy.empty((nz,numpy.dot(nocc, nvir)), dtype=z1.dtype)
+    p1 = 0
+    for k in range(nkpts):
+        p0, p1 = p1, p1 + nocc[k] * nvir[k]
+        out[:,p0:p1].reshape(nz,nocc[k],nvir[k])[:] = z1[:,k,:nocc[k],:nvir[k]]
+    return out
+
+def _get_buffer(bufs, key, size, dtype=numpy.complex128):
+    '''A buffer which can hold size elements of the given dtype. The buffer is
+    kept in the dict bufs and reused until a larger one is requested.
+    '''
+    if key not in bufs or bufs[key].nbytes < size * numpy.dtype(dtype).itemsize:
+        bufs[key] = numpy.empty(size, dtype=dtype)
+    return bufs[key]
+
+def _promote(dtype, a):
+    '''The real or complex dtype of the precision of dtype which can hold the
+    elements of array a'''
+    if numpy.iscomplexobj(a):
+        return numpy.result_type(dtype, numpy.complex64)
+    else:
+        return numpy.dtype(dtype)
+
 def _unpack(vo, mo_occ):
+    mo_occ = numpy.asarray(mo_occ)
+    nocc = numpy.count_nonzero(mo_occ > 0, axis=1)
+    nvir = mo_occ.shape[1] - nocc
     z = []
     p1 = 0
-    for k, occ in enumerate(mo_occ):
-        no = numpy.count_nonzero(occ > 0)
-        nv = occ.size - no
+    for no, nv in zip(nocc, nvir):
         p0, p1 = p1, p1 + no * nv
         z.append(vo[p0:p1].reshape(no,nv))
     return z
@@ -23,7 +23,7 @@ from pyscf.lib import logger
 from pyscf.ao2mo import _ao2mo
 from pyscf.tdscf import uhf
 from pyscf.scf import uhf_symm
-from pyscf.pbc.tdscf.krhf import _get_e_ia
+from pyscf.pbc.tdscf.krhf import _get_e_ia, _stack_ov, _pad_ov, _unpad_ov
 from pyscf.pbc.scf.newton_ah import _gen_uhf_response
 from pyscf import __config__
 
@@ -51,7 +51,7 @@ class TDA(uhf.TDA):
         mo_coeff = mf.mo_coeff
         mo_energy = mf.mo_energy
         mo_occ = mf.mo_occ
-        nkpts = len(mo_occ)
+        nkpts = len(mo_occ[0])
         nao, nmo = mo_coeff[0][0].shape
         occidxa = [numpy.where(mo_occ[0][k]> 0)[0] for k in range(nkpts)]
         occidxb = [numpy.where(mo_occ[1][k]> 0)[0] for k in range(nkpts)]
@@ -68,39 +68,46 @@ class TDA(uhf.TDA):
         tot_x_a = sum(x.size for x in e_ia_a)
         tot_x_b = sum(x.size for x in e_ia_b)
 
+        nocca = numpy.count_nonzero(numpy.asarray(mo_occ[0]) > 0, axis=1)
+        noccb = numpy.count_nonzero(numpy.asarray(mo_occ[1]) > 0, axis=1)
+        nvira = nmo - nocca
+        nvirb = nmo - noccb
+        # The orbitals of all k-points are stacked in zero-padded arrays to
+        # transform all states and k-points in one batched matmul
+        orboa, orbva = _stack_ov(orboa, orbva)
+        orbob, orbvb = _stack_ov(orbob, orbvb)
+        orboa_h = numpy.asarray(orboa.conj().transpose(0,2,1), order='C')
+        orbob_h = numpy.asarray(orbob.conj().transpose(0,2,1), order='C')
+        orbva_h = numpy.asarray(orbva.conj().transpose(0,2,1), order='C')
+        orbvb_h = numpy.asarray(orbvb.conj().transpose(0,2,1), order='C')
+        shape_a = (nocca, nvira, orboa.shape[2], orbva.shape[2])
+        shape_b = (noccb, nvirb, orbob.shape[2], orbvb.shape[2])
+
         mem_now = lib.current_memory()[0]
         max_memory = max(2000, self.max_memory*.8-mem_now)
         vresp = _gen_uhf_response(mf, hermi=0, max_memory=max_memory)
 
         def vind(zs):
+            zs = numpy.asarray(zs)
             nz = len(zs)
-            zs = [_unpack(z, mo_occ) for z in zs]
+            za = _pad_ov(zs[:,:tot_x_a], *shape_a)
+            zb = _pad_ov(zs[:,tot_x_a:], *shape_b)
             dmov = numpy.empty((2,nz,nkpts,nao,nao), dtype=numpy.complex128)
-            for i in range(nz):
-                dm1a, dm1b = zs[i]
-                for k in range(nkpts):
-                    dmov[0,i,k] = reduce(numpy.dot, (orboa[k], dm1a[k], orbva[k].conj().T))
-                    dmov[1,i,k] = reduce(numpy.dot, (orbob[k], dm1b[k], orbvb[k].conj().T))
+            numpy.matmul(orboa, numpy.matmul(za, orbva_h), out=dmov[0])
+            numpy.matmul(orbob, numpy.matmul(zb, orbvb_h), out=dmov[1])
 
             with lib.temporary_env(mf, exxdiv=None):
                 dmov = dmov.reshape(2*nz,nkpts,nao,nao)
                 v1ao = vresp(dmov)
                 v1ao = v1ao.reshape(2,nz,nkpts,nao,nao)
 
-            v1s = []
-            for i in range(nz):
-                dm1a, dm1b = zs[i]
-                v1as = []
-                v1bs = []
-                for k in range(nkpts):
-                    v1a = reduce(numpy.dot, (orboa[k].conj().T, v1ao[0,i,k], orbva[k]))
-                    v1b = reduce(numpy.dot, (orbob[k].conj().T, v1ao[1,i,k], orbvb[k]))
-                    v1a += e_ia_a[k] * dm1a[k]
-                    v1b += e_ia_b[k] * dm1b[k]
-                    v1as.append(v1a.ravel())
-                    v1bs.append(v1b.ravel())
-                v1s += v1as + v1bs
-            return numpy.hstack(v1s).reshape(nz,-1)
+            v1s = numpy.empty((nz,tot_x_a+tot_x_b), dtype=numpy.complex128)
+            _unpad_ov(reduce(numpy.matmul, (orboa_h, v1ao[0], orbva)),
+                      nocca, nvira, out=v1s[:,:tot_x_a])
+            _unpad_ov(reduce(numpy.matmul, (orbob_h, v1ao[1], orbvb)),
+                      noccb, nvirb, out=v1s[:,tot_x_a:])
+            v1s += hdiag * zs
+            return v1s
 
         return vind, hdiag
 
@@ -157,7 +164,7 @@ class TDHF(TDA):
         mo_coeff = mf.mo_coeff
         mo_energy = mf.mo_energy
         mo_occ = mf.mo_occ
-        nkpts = len(mo_occ)
+        nkpts = len(mo_occ[0])
         nao, nmo = mo_coeff[0][0].shape
         occidxa = [numpy.where(mo_occ[0][k]> 0)[0] for k in range(nkpts)]
         occidxb = [numpy.where(mo_occ[1][k]> 0)[0] for k in range(nkpts)]
@@ -175,55 +182,59 @@ class TDHF(TDA):
         tot_x_a = sum(x.size for x in e_ia_a)
         tot_x_b = sum(x.size for x in e_ia_b)
         tot_x = tot_x_a + tot_x_b
+        # The diagonal of [A, B; -B*, -A*] without the J/K contribution
+        e_ia_xy = numpy.hstack((hdiag[:tot_x], -hdiag[:tot_x]))
+
+        nocca = numpy.count_nonzero(numpy.asarray(mo_occ[0]) > 0, axis=1)
+        noccb = numpy.count_nonzero(numpy.asarray(mo_occ[1]) > 0, axis=1)
+        nvira = nmo - nocca
+        nvirb = nmo - noccb
+        # The orbitals of all k-points are stacked in zero-padded arrays to
+        # transform all states and k-points in one batched matmul
+        orboa, orbva = _stack_ov(orboa, orbva)
+        orbob, orbvb = _stack_ov(orbob, orbvb)
+        orboa_h = numpy.asarray(orboa.conj().transpose(0,2,1), order='C')
+        orbob_h = numpy.asarray(orbob.conj().transpose(0,2,1), order='C')
+        orbva_h = numpy.asarray(orbva.conj().transpose(0,2,1), order='C')
+        orbvb_h = numpy.asarray(orbvb.conj().transpose(0,2,1), order='C')
+        shape_a = (nocca, nvira, orboa.shape[2], orbva.shape[2])
+        shape_b = (noccb, nvirb, orbob.shape[2], orbvb.shape[2])
 
         mem_now = lib.current_memory()[0]
         max_memory = max(2000, self.max_memory*.8-mem_now)
         vresp = _gen_uhf_response(mf, hermi=0, max_memory=max_memory)
 
         def vind(xys):
+            xys = numpy.asarray(xys)
             nz = len(xys)
-            x1s = [_unpack(x[:tot_x], mo_occ) for x in xys]
-            y1s = [_unpack(x[tot_x:], mo_occ) for x in xys]
+            xa = _pad_ov(xys[:,:tot_x_a], *shape_a)
+            xb = _pad_ov(xys[:,tot_x_a:tot_x], *shape_b)
+            ya = _pad_ov(xys[:,tot_x:tot_x+tot_x_a], *shape_a).transpose(0,1,3,2)
+            yb = _pad_ov(xys[:,tot_x+tot_x_a:], *shape_b).transpose(0,1,3,2)
             dmov = numpy.empty((2,nz,nkpts,nao,nao), dtype=numpy.complex128)
-            for i in range(nz):
-                xa, xb = x1s[i]
-                ya, yb = y1s[i]
-                for k in range(nkpts):
-                    dmx = reduce(numpy.dot, (orboa[k], xa[k]  , orbva[k].conj().T))
-                    dmy = reduce(numpy.dot, (orbva[k], ya[k].T, orboa[k].conj().T))
-                    dmov[0,i,k] = dmx + dmy  # AX + BY
-                    dmx = reduce(numpy.dot, (orbob[k], xb[k]  , orbvb[k].conj().T))
-                    dmy = reduce(numpy.dot, (orbvb[k], yb[k].T, orbob[k].conj().T))
-                    dmov[1,i,k] = dmx + dmy  # AX + BY
+            # AX + BY
+            numpy.matmul(orboa, numpy.matmul(xa, orbva_h), out=dmov[0])
+            numpy.matmul(orbob, numpy.matmul(xb, orbvb_h), out=dmov[1])
+            dmov[0] += numpy.matmul(orbva, numpy.matmul(ya, orboa_h))
+            dmov[1] += numpy.matmul(orbvb, numpy.matmul(yb, orbob_h))
 
             with lib.temporary_env(mf, exxdiv=None):
                 dmov = dmov.reshape(2*nz,nkpts,nao,nao)
                 v1ao = vresp(dmov)
                 v1ao = v1ao.reshape(2,nz,nkpts,nao,nao)
 
-            v1s = []
-            for i in range(nz):
-                xa, xb = x1s[i]
-                ya, yb = y1s[i]
-                v1xsa = []
-                v1xsb = []
-                v1ysa = []
-                v1ysb = []
-                for k in range(nkpts):
-                    v1xa = reduce(numpy.dot, (orboa[k].conj().T, v1ao[0,i,k], orbva[k]))
-                    v1xb = reduce(numpy.dot, (orbob[k].conj().T, v1ao[1,i,k], orbvb[k]))
-                    v1ya = reduce(numpy.dot, (orbva[k].conj().T, v1ao[0,i,k], orboa[k])).T
-                    v1yb = reduce(numpy.dot, (orbvb[k].conj().T, v1ao[1,i,k], orbob[k])).T
-                    v1xa+= e_ia_a[k] * xa[k]
-                    v1xb+= e_ia_b[k] * xb[k]
-                    v1ya+= e_ia_a[k] * ya[k]
-                    v1yb+= e_ia_b[k] * yb[k]
-                    v1xsa.append(v1xa.ravel())
-                    v1xsb.append(v1xb.ravel())
-                    v1ysa.append(-v1ya.ravel())
-                    v1ysb.append(-v1yb.ravel())
-                v1s += v1xsa + v1xsb + v1ysa + v1ysb
-            return numpy.hstack(v1s).reshape(nz,-1)
+            v1s = numpy.empty((nz,tot_x*2), dtype=numpy.complex128)
+            v1xa = reduce(numpy.matmul, (orboa_h, v1ao[0], orbva))
+            v1xb = reduce(numpy.matmul, (orbob_h, v1ao[1], orbvb))
+            v1ya = reduce(numpy.matmul, (orbva_h, v1ao[0], orboa)).transpose(0,1,3,2)
+            v1yb = reduce(numpy.matmul, (orbvb_h, v1ao[1], orbob)).transpose(0,1,3,2)
+            _unpad_ov(v1xa, nocca, nvira, out=v1s[:,:tot_x_a])
+            _unpad_ov(v1xb, noccb, nvirb, out=v1s[:,tot_x_a:tot_x])
+            _unpad_ov(v1ya, nocca, nvira, out=v1s[:,tot_x:tot_x+tot_x_a])
+            _unpad_ov(v1yb, noccb, nvirb, out=v1s[:,tot_x+tot_x_a:])
+            v1s[:,tot_x:] *= -1
+            v1s += e_ia_xy * xys
+            return v1s
 
         return vind, hdiag
 
@@ -277,18 +288,17 @@ class TDHF(TDA):
 RPA = KTDHF = TDHF
 
 def _unpack(vo, mo_occ):
+    mo_occ = numpy.asarray(mo_occ)
+    nocc = numpy.count_nonzero(mo_occ > 0, axis=2)
+    nvir = mo_occ.shape[2] - nocc
     za = []
     zb = []
     p1 = 0
-    for k, occ in enumerate(mo_occ[0]):
-        no = numpy.count_nonzero(occ > 0)
-        nv = occ.size - no
+    for no, nv in zip(nocc[0], nvir[0]):
         p0, p1 = p1, p1 + no * nv
         za.append(vo[p0:p1].reshape(no,nv))
 
-    for k, occ in enumerate(mo_occ[1]):
-        no = numpy.count_nonzero(occ > 0)
-        nv = occ.size - no
+    for no, nv in zip(nocc[1], nvir[1]):
         p0, p1 = p1, p1 + no * nv
         zb.append(vo[p0:p1].reshape(no,nv))
     return za, zb
@@ -74,6 +74,19 @@ class KnownValues(unittest.TestCase):
         self.assertAlmostEqual(abs(e1-e2).max(), 0, 4)
         self.assertAlmostEqual(lib.finger(e1), 1.1580752883710259, 5)
 
+    def test_mixed_precision(self):
+        # The single precision MO/AO transforms should change the excitation
+        # energies by less than 1e-5 relative to the double precision run
+        for kmesh in ([1, 1, 1], [1, 1, 2]):
+            kmf = KRHF(cell, cell.make_kpts(kmesh)).run()
+            for method in (tdscf.KTDA, tdscf.KTDHF):
+                td_model = method(kmf)
+                td_model.nstates = 3
+                e1 = td_model.kernel()[0]
+                td_model.mixed_precision = True
+                e2 = td_model.kernel()[0]
+                self.assertAlmostEqual(abs((e1-e2)/e1).max(), 0, 5)
+
 if __name__ == '__main__':
     print("Tests for pbc.tdscf.rhf")
     unittest.main()
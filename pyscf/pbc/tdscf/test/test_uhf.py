@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# Copyright 2014-2018 The PySCF Developers. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import numpy
+from pyscf.pbc.gto import Cell
+from pyscf.pbc.scf import KRHF, KUHF
+from pyscf.pbc.tdscf import krhf, kuhf
+
+cell = Cell()
+cell.atom = '''
+C 0.000000000000   0.000000000000   0.000000000000
+C 1.685068664391   1.685068664391   1.685068664391
+'''
+cell.basis = {'C': [[0, (0.8, 1.0)],
+                    [1, (1.0, 1.0)]]}
+cell.pseudo = 'gth-pade'
+cell.a = '''
+0.000000000, 3.370137329, 3.370137329
+3.370137329, 0.000000000, 3.370137329
+3.370137329, 3.370137329, 0.000000000'''
+cell.unit = 'B'
+cell.verbose = 0
+cell.build()
+
+def tearDownModule():
+    global cell
+    del cell
+
+class KnownValues(unittest.TestCase):
+    def test_tda_3kpts(self):
+        # The KUHF excitations of a closed shell system are the union of the
+        # KRHF singlet and triplet excitations
+        kpts = cell.make_kpts([1, 1, 3])
+        kmf = KRHF(cell, kpts).run()
+        td_model = krhf.TDA(kmf)
+        td_model.nstates = 5
+        e_s = td_model.kernel()[0]
+        td_model.singlet = False
+        e_t = td_model.kernel()[0]
+        e1 = numpy.sort(numpy.hstack((e_s, e_t)))[:4]
+
+        kmf = KUHF(cell, kpts).run()
+        td_model = kuhf.TDA(kmf)
+        td_model.nstates = 4
+        e2 = td_model.kernel()[0]
+        self.assertAlmostEqual(abs(e1-e2).max(), 0, 5)
+
+if __name__ == '__main__':
+    print("Tests for pbc.tdscf.kuhf")
+    unittest.main()